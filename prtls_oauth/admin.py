@@ -1,17 +1,53 @@
 from django.contrib import admin
 from django.urls import reverse, path
-from django.utils.html import format_html
+from django.utils.safestring import mark_safe
 from django.utils.timezone import now
 from django.urls import re_path
 
 from django.contrib import messages
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Now, Substr
 from prtls_utils.utils import get_setting
 from prtls_oauth.models import OAuthToken
+from prtls_oauth.services import OAuthService
 from django.shortcuts import redirect
+from collections import defaultdict
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
 import logging
 
 logger = logging.getLogger('oauth')
 
+REFRESH_MAX_WORKERS = 8
+
+
+@lru_cache(maxsize=32)
+def _resolve_oauth_service(service_class_path):
+    """
+    Import and return the class at a dotted path. Cached so repeated lookups skip the import machinery.
+    """
+    module_name, class_name = service_class_path.rsplit(".", 1)
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)
+
+
+class OAuthTokenChangeList(ChangeList):
+    """
+    Changelist that slices the token previews and computes token validity in the database,
+    and defers the full token columns so the list never loads the TEXT payloads.
+    The change form keeps the default queryset, since it displays the full tokens.
+    """
+
+    def get_queryset(self, request, *args, **kwargs):
+        return super().get_queryset(request, *args, **kwargs).annotate(
+            access_preview=Substr("access_token", 1, 10),
+            refresh_preview=Substr("refresh_token", 1, 10),
+            token_valid=ExpressionWrapper(Q(expires_at__gt=Now()), output_field=BooleanField()),
+        ).defer("access_token", "refresh_token")
+
+
 @admin.register(OAuthToken)
 class OAuthTokenAdmin(admin.ModelAdmin):
     """
@@ -33,8 +69,12 @@ class OAuthTokenAdmin(admin.ModelAdmin):
     ordering = ("service", "-expires_at")
     readonly_fields = ("access_token", "refresh_token", "created_at", "updated_at", "access_token_preview", "refresh_token_preview", "token_type", "user_id", "service", "expires_at", "is_access_token_valid")
     change_list_template = "admin/prtls_oauth/oauthtoken/change_list.html"
+    list_per_page = 50
+
+    _VALID_HTML = mark_safe('<span style="color: green;">Valid</span>')
+    _EXPIRED_HTML = mark_safe('<span style="color: red;">Expired</span>')
 
-    actions = ["refresh_access_token"]
+    actions = ["refresh_access_token", "force_refresh_access_token"]
 
     fieldsets = (
         ("User Information", {
@@ -48,33 +88,37 @@ class OAuthTokenAdmin(admin.ModelAdmin):
         }),
     )
 
-    # 🔹 Define a mapping of services to their respective classes dynamically
-    OAUTH_PROVIDERS = get_setting("OAUTH_PROVIDERS", {})
+    # 🔹 Mapping of services to their respective classes, read on first use rather than at import
+    @classmethod
+    @lru_cache(maxsize=1)
+    def _providers(cls):
+        return get_setting("OAUTH_PROVIDERS", {}) or {}
 
     @classmethod
     def get_oauth_service(cls, service_name):
         """
         Dynamically import and return the OAuth service class for a given service name.
         """
-        service_class_path = cls.OAUTH_PROVIDERS.get(service_name.lower())
+        service_class_path = cls._providers().get(service_name.lower())
         if not service_class_path:
             return None
-        
-        module_name, class_name = service_class_path.rsplit(".", 1)
-        
+
         try:
-            module = __import__(module_name, fromlist=[class_name])
-            return getattr(module, class_name)
-        except (ImportError, AttributeError) as e:
-            logger.error(f"Failed to import {class_name} from {module_name}: {e}")
+            return _resolve_oauth_service(service_class_path)
+        except (ImportError, AttributeError, ValueError) as e:
+            logger.error("Failed to import %s: %s", service_class_path, e)
             return None
 
+    def get_changelist(self, request, **kwargs):
+        return OAuthTokenChangeList
+
     def access_token_preview(self, obj):
         """
         Display a preview of the access token (first 10 characters).
         """
-        if obj.access_token:
-            return f"{obj.access_token[:10]}..."
+        preview = obj.access_preview if hasattr(obj, "access_preview") else (obj.access_token or "")[:10]
+        if preview:
+            return f"{preview}..."
         return "No Access Token"
     access_token_preview.short_description = "Access Token"
 
@@ -82,8 +126,9 @@ class OAuthTokenAdmin(admin.ModelAdmin):
         """
         Display a preview of the refresh token (first 10 characters).
         """
-        if obj.refresh_token:
-            return f"{obj.refresh_token[:10]}..."
+        preview = obj.refresh_preview if hasattr(obj, "refresh_preview") else (obj.refresh_token or "")[:10]
+        if preview:
+            return f"{preview}..."
         return "No Refresh Token"
     refresh_token_preview.short_description = "Refresh Token"
 
@@ -91,52 +136,155 @@ class OAuthTokenAdmin(admin.ModelAdmin):
         """
         Check if the access token is still valid.
         """
-        if obj.expires_at and obj.expires_at > now():
-            return format_html('<span style="color: green;">Valid</span>')
-        return format_html('<span style="color: red;">Expired</span>')
+        if hasattr(obj, "token_valid"):
+            valid = obj.token_valid
+        else:
+            valid = bool(obj.expires_at and obj.expires_at > now())
+        return self._VALID_HTML if valid else self._EXPIRED_HTML
     is_access_token_valid.short_description = "Access Token Validity"
 
     def refresh_access_token(self, request, queryset):
         """
         Admin action to refresh access tokens for selected services.
+        Tokens that are not close to expiring are skipped.
+        """
+        self._refresh_tokens(request, queryset, force=False)
+
+    refresh_access_token.short_description = "Refresh Access Token(s)"
+
+    def force_refresh_access_token(self, request, queryset):
+        """
+        Admin action to refresh access tokens for selected services, regardless of expiry.
         """
-        if not queryset.exists():
+        self._refresh_tokens(request, queryset, force=True)
+
+    force_refresh_access_token.short_description = "Force Refresh Access Token(s)"
+
+    def _refresh_tokens(self, request, queryset, force):
+        """
+        Refresh the selected tokens, grouped per service.
+        Unless forced, tokens with more than OAUTH_REFRESH_SKEW_SECONDS of life left are skipped.
+        """
+        # The refresh needs the full token columns deferred by the changelist queryset
+        tokens = list(queryset.defer(None))
+        if not tokens:
             self.message_user(request, "No tokens selected. Please select at least one token to refresh.", messages.WARNING)
             return
 
-        for token in queryset:
-            try:
-                # Dynamically get the correct service class
-                service_class = self.get_oauth_service(token.service)
-                if not service_class:
-                    raise RuntimeError(f"No service found for {token.service}")
+        skew = timedelta(seconds=get_setting("OAUTH_REFRESH_SKEW_SECONDS", 300))
+        current_time = now()
 
-                # Call the refresh method
-                service_class.refresh_access_token(token)
-                self.message_user(request, f"Access token refreshed for {token.service} - user: {token.user_id}", messages.SUCCESS)
+        tokens_by_service = defaultdict(list)
+        skipped = 0
+        for token in tokens:
+            if not force and token.expires_at - current_time > skew:
+                skipped += 1
+                continue
+            tokens_by_service[token.service].append(token)
+
+        if skipped:
+            self.message_user(request, f"Skipped {skipped} token(s) that are still valid. Use force refresh to refresh them anyway.", messages.INFO)
 
+        for service_name, service_tokens in tokens_by_service.items():
+            # Dynamically get the correct service class, once per service
+            service_class = self.get_oauth_service(service_name)
+            if not service_class:
+                logger.error("No service found for %s", service_name)
+                self.message_user(request, f"No service found for {service_name}", messages.ERROR)
+                continue
+
+            # A provider that customises the refresh or its persistence is honoured token by token
+            if self._overrides_refresh(service_class):
+                self._refresh_service_tokens_individually(request, service_name, service_class, service_tokens)
+                continue
+
+            # Hit the provider concurrently, then persist all results in a single UPDATE
+            with ThreadPoolExecutor(max_workers=min(REFRESH_MAX_WORKERS, len(service_tokens))) as executor:
+                futures = [(token, executor.submit(service_class.fetch_refreshed_token, token)) for token in service_tokens]
+
+            refreshed, failures = [], []
+            for token, future in futures:
+                try:
+                    data = future.result()
+                except Exception as e:
+                    logger.error("Failed to refresh token for %s - user %s: %s", service_name, token.user_id, e)
+                    failures.append(f"{token.user_id} ({e})")
+                    continue
+
+                refreshed.append(service_class.apply_token_response(token, data))
+
+            if refreshed:
+                try:
+                    OAuthToken.objects.bulk_update(refreshed, service_class.TOKEN_RESPONSE_FIELDS)
+                except Exception as e:
+                    logger.error("Failed to save refreshed tokens for %s: %s", service_name, e, exc_info=True)
+                    self.message_user(request, f"Failed to save refreshed tokens for {service_name}: {e}", messages.ERROR)
+                else:
+                    self.message_user(request, f"Access token refreshed for {service_name} - {len(refreshed)} token(s)", messages.SUCCESS)
+
+            if failures:
+                self.message_user(request, f"Failed to refresh token for {service_name} - users: {', '.join(failures)}", messages.ERROR)
+
+    @staticmethod
+    def _overrides_refresh(service_class):
+        """
+        Whether the service overrides refresh_access_token or save_or_update_token,
+        which the bulk refresh would otherwise bypass.
+        """
+        return any(
+            getattr(service_class, name).__func__ is not getattr(OAuthService, name).__func__
+            for name in ("refresh_access_token", "save_or_update_token")
+        )
+
+    def _refresh_service_tokens_individually(self, request, service_name, service_class, tokens):
+        """
+        Refresh tokens one at a time through the service's own refresh_access_token.
+        """
+        refreshed, failures = 0, []
+        for token in tokens:
+            try:
+                service_class.refresh_access_token(token)
+                refreshed += 1
             except Exception as e:
-                logger.error(f"Failed to refresh token for {token.service} - user {token.user_id}: {e}")
-                self.message_user(request, f"Failed to refresh token for {token.service} - user {token.user_id}: {e}", messages.ERROR)
+                logger.error("Failed to refresh token for %s - user %s: %s", service_name, token.user_id, e)
+                failures.append(f"{token.user_id} ({e})")
 
-    refresh_access_token.short_description = "Refresh Access Token(s)"
+        if refreshed:
+            self.message_user(request, f"Access token refreshed for {service_name} - {refreshed} token(s)", messages.SUCCESS)
+
+        if failures:
+            self.message_user(request, f"Failed to refresh token for {service_name} - users: {', '.join(failures)}", messages.ERROR)
 
     def changelist_view(self, request, extra_context=None):
         """
         Override the changelist view to add 'Authorize' buttons for each OAuth provider.
         """
         extra_context = extra_context or {}
+        extra_context['authorize_urls'] = self.get_authorize_urls()
+        return super().changelist_view(request, extra_context=extra_context)
+
+    @cached_property
+    def _authorize_url_cache(self):
+        return {}
+
+    def get_authorize_urls(self):
+        """
+        Authorize URLs for each OAuth provider. Resolved URLs are cached since the provider set
+        is static; failed lookups are retried on the next render.
+        """
         authorize_urls = {}
 
-        for service_name in self.OAUTH_PROVIDERS.keys():
+        for service_name in self._providers().keys():
+            url = self._authorize_url_cache.get(service_name)
+            if url is None:
                 try:
-                    authorize_urls[service_name] = reverse("admin:authorize_service", args=[service_name])
+                    url = reverse("admin:authorize_service", args=[service_name])
+                    self._authorize_url_cache[service_name] = url
                 except Exception as e:
-                    logger.error(f"Failed to reverse URL for {service_name}: {e}")
-                    authorize_urls[service_name] = None
+                    logger.error("Failed to reverse URL for %s: %s", service_name, e)
+            authorize_urls[service_name] = url
 
-        extra_context['authorize_urls'] = authorize_urls
-        return super().changelist_view(request, extra_context=extra_context)
+        return authorize_urls
 
     def get_urls(self):
         """
@@ -165,7 +313,7 @@ class OAuthTokenAdmin(admin.ModelAdmin):
             return redirect(auth_url)
 
         except Exception as e:
-            logger.error(f"Failed to initiate OAuth for {service_name}: {e}")
+            logger.error("Failed to initiate OAuth for %s: %s", service_name, e)
             self.message_user(request, f"Failed to initiate OAuth for {service_name}: {e}", messages.ERROR)
             return redirect("..")
         
@@ -178,5 +326,5 @@ class OAuthTokenAdmin(admin.ModelAdmin):
             template = select_template([template_name])
             return template.template.name  # Returns the exact template path
         except Exception as e:
-            logger.error(f"Template {template_name} not found: {e}")
+            logger.error("Template %s not found: %s", template_name, e)
             return "Template not found"
\ No newline at end of file
@@ -2,13 +2,96 @@ import requests
 import datetime
 import secrets
 import logging
+import threading
+from functools import lru_cache
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from asgiref.sync import sync_to_async
 from django.apps import apps
-from django.urls import reverse
+from django.db import connections, router
+from django.urls import get_script_prefix, reverse
 from django.utils.timezone import now
 from prtls_utils.utils import get_setting
 
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
 logger = logging.getLogger('oauth')
 
+REQUEST_TIMEOUT = (3.05, 10)
+_local = threading.local()
+
+
+def _get_session():
+    """
+    Return this thread's requests.Session, so token endpoint calls reuse pooled keep-alive
+    connections. Sessions are per thread because requests doesn't guarantee a Session is
+    thread-safe, and the admin refreshes tokens from a thread pool.
+    urllib3 only retries idempotent methods on read/status errors, so POSTs are
+    retried on connection failures only and authorization codes are never replayed.
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503, 504)),
+        ))
+        _local.session = session
+    return session
+
+
+_SENSITIVE_KEYS = frozenset({"client_secret", "code", "access_token", "refresh_token", "id_token"})
+
+
+def _redact(data):
+    """ Mask secrets in a token payload or response before it is logged """
+    return {key: "***" if key in _SENSITIVE_KEYS else value for key, value in data.items()}
+
+
+@lru_cache(maxsize=16)
+def _reverse_callback(app_name, provider_name, script_prefix):
+    """
+    Resolve the callback path once per provider and script prefix; URL patterns are static
+    per deployment, but reverse() prepends the current thread's script prefix.
+    """
+    return reverse(f"{app_name}:{provider_name}_callback")
+
+
+# Per-call authorization URL parameters; EXTRA_AUTH_PARAMS may still override them
+_DYNAMIC_AUTH_PARAMS = ("redirect_uri", "state")
+
+
+@lru_cache(maxsize=32)
+def _static_auth_query(client_id, scope, extra_params):
+    """
+    Encode the authorization URL parameters that don't change between calls.
+    Keyed on the values themselves, so changed class attributes are never served stale.
+    """
+    return urlencode({
+        "response_type": "code",
+        "client_id": client_id,
+        "scope": scope,
+        **{key: value for key, value in extra_params if key not in _DYNAMIC_AUTH_PARAMS},
+    })
+
+
+@lru_cache(maxsize=1)
+def _load_token_model():
+    """ Resolved on first use, once the app registry is ready, then reused """
+    return apps.get_model("prtls_oauth", "OAuthToken")
+
+
+@lru_cache(maxsize=1)
+def _get_site_url():
+    """ SITE_URL is read on every redirect URI built without a request """
+    return get_setting("SITE_URL")
+
+
 class OAuthService:
     """
     Generic OAuth service that can be subclassed for specific providers (Google, Zoho, Microsoft, etc.).
@@ -26,11 +109,17 @@ class OAuthService:
     OAUTH_SCOPE = None
     APP_NAME = "oauth" # The Django app name, needed for reverse URLs, override in subclass
     EXTRA_AUTH_PARAMS = {}  # Allow subclasses to specify provider-specific parameters
+    AUTH_TOKEN_MODEL = None  # Optional token model override, defaults to prtls_oauth.OAuthToken
+    TOKEN_RESPONSE_FIELDS = ["access_token", "refresh_token", "expires_at", "token_type", "updated_at"]  # Fields set by apply_token_response
 
-    @property
-    def AUTH_TOKEN_MODEL(self):
-        """ Lazily load the OAuthToken model to avoid AppRegistryNotReady issues """
-        return apps.get_model("prtls_oauth", "OAuthToken")  # ✅ This ensures the model is loaded dynamically
+    @classmethod
+    def _get_token_model(cls):
+        """ Return the subclass's AUTH_TOKEN_MODEL if set, else the lazily loaded OAuthToken model """
+        model = cls.AUTH_TOKEN_MODEL
+        if isinstance(model, property):
+            # Subclasses written against the former AUTH_TOKEN_MODEL property
+            model = model.fget(cls())
+        return model or _load_token_model()
 
     
     @classmethod
@@ -46,41 +135,41 @@ class OAuthService:
         Returns:
             str: A valid access token.
         """
-        OAuthToken = cls().AUTH_TOKEN_MODEL
+        OAuthToken = cls._get_token_model()
         try:
-            # Check for an existing valid access token
-            token = OAuthToken.objects.filter(
+            # Fast path: fetch only the access token string, without building a model instance
+            access_token = OAuthToken.objects.filter(
                 user_id=user_id, 
                 service=cls.OAUTH_PROVIDER_NAME, 
                 expires_at__gt=now()
-            ).first()
+            ).values_list("access_token", flat=True).first()
 
-            if token:
-                logger.info(f"Using existing valid {cls.OAUTH_PROVIDER_NAME} token for user {user_id}")
-                return token.access_token
+            if access_token:
+                logger.info("Using existing valid %s token for user %s", cls.OAUTH_PROVIDER_NAME, user_id)
+                return access_token
 
             # If no valid token, check for a refresh token
             token = OAuthToken.objects.filter(
                 user_id=user_id, 
                 service=cls.OAUTH_PROVIDER_NAME, 
                 refresh_token__isnull=False
-            ).first()
+            ).only("user_id", "refresh_token").first()
 
-            if token:
-                logger.info(f"Refreshing {cls.OAUTH_PROVIDER_NAME} token for user {user_id}")
+            if token and token.refresh_token:
+                logger.info("Refreshing %s token for user %s", cls.OAUTH_PROVIDER_NAME, user_id)
                 refreshed_token = cls.refresh_access_token(token)
 
                 if refreshed_token and refreshed_token.access_token:
                     return refreshed_token.access_token
 
-                logger.error(f"Failed to refresh {cls.OAUTH_PROVIDER_NAME} token for user {user_id}")
+                logger.error("Failed to refresh %s token for user %s", cls.OAUTH_PROVIDER_NAME, user_id)
             
             # If refresh token is not available, log error and request reauthorization
-            logger.warning(f"No valid {cls.OAUTH_PROVIDER_NAME} token or refresh token found for user {user_id}. Reauthorization required.")
+            logger.warning("No valid %s token or refresh token found for user %s. Reauthorization required.", cls.OAUTH_PROVIDER_NAME, user_id)
             raise RuntimeError(f"No valid {cls.OAUTH_PROVIDER_NAME} token. Please reauthorize.")
 
         except Exception as e:
-            logger.error(f"Failed to get {cls.OAUTH_PROVIDER_NAME} token for user {user_id}: {e}", exc_info=True)
+            logger.error("Failed to get %s token for user %s: %s", cls.OAUTH_PROVIDER_NAME, user_id, e, exc_info=True)
             raise RuntimeError(f"Failed to get {cls.OAUTH_PROVIDER_NAME} token: {e}")
 
 
@@ -98,17 +187,11 @@ class OAuthService:
         state = state or secrets.token_urlsafe(16)
         redirect_uri = cls.get_redirect_uri()
 
-        params = {
-            "response_type": "code",
-            "client_id": cls.OAUTH_CLIENT_ID,
-            "redirect_uri": redirect_uri,
-            "scope": cls.OAUTH_SCOPE,
-            "state": state,
-        }
-
-        params.update(cls.EXTRA_AUTH_PARAMS)
+        dynamic_params = {"redirect_uri": redirect_uri, "state": state}
+        dynamic_params.update((key, cls.EXTRA_AUTH_PARAMS[key]) for key in _DYNAMIC_AUTH_PARAMS if key in cls.EXTRA_AUTH_PARAMS)
 
-        auth_url = f"{cls.OAUTH_BASE_URL}{cls.OAUTH_AUTH_ENDPOINT}?" + "&".join(f"{key}={value}" for key, value in params.items())
+        static_query = _static_auth_query(cls.OAUTH_CLIENT_ID, cls.OAUTH_SCOPE, tuple(cls.EXTRA_AUTH_PARAMS.items()))
+        auth_url = f"{cls.OAUTH_BASE_URL}{cls.OAUTH_AUTH_ENDPOINT}?{static_query}&{urlencode(dynamic_params)}"
         return auth_url
 
     @classmethod
@@ -121,10 +204,39 @@ class OAuthService:
             user_id (str): Identifier for the user.
 
         Returns:
-            str: The access token.
+            Saved OAuthToken instance.
+        """
+        data = cls.fetch_authorization_tokens(code)
+        return cls.save_token_response(data, user_id)
+
+    @classmethod
+    async def aexchange_authorization_code(cls, code, user_id="default"):
+        """
+        Async variant of exchange_authorization_code for async views under ASGI.
+        The provider request runs in a worker thread so the event loop is not blocked.
+
+        Args:
+            code (str): The authorization code.
+            user_id (str): Identifier for the user.
+
+        Returns:
+            Saved OAuthToken instance.
+        """
+        data = await sync_to_async(cls.fetch_authorization_tokens, thread_sensitive=False)(code)
+        return await sync_to_async(cls.save_token_response)(data, user_id)
+
+    @classmethod
+    def fetch_authorization_tokens(cls, code):
         """
+        Exchange the authorization code with the provider without persisting the tokens.
+
+        Args:
+            code (str): The authorization code.
 
-        logger.info(f"Exchanging authorization code for {cls.OAUTH_PROVIDER_NAME} tokens")
+        Returns:
+            dict: The provider's token response.
+        """
+        logger.info("Exchanging authorization code for %s tokens", cls.OAUTH_PROVIDER_NAME)
 
         if not cls.OAUTH_CLIENT_ID or not cls.OAUTH_CLIENT_SECRET or not cls.OAUTH_TOKEN_ENDPOINT:
             raise RuntimeError("OAuth credentials missing in subclass.")
@@ -140,22 +252,37 @@ class OAuthService:
             "grant_type": "authorization_code",
         }
 
-        logger.info(f"Requesting tokens from {cls.OAUTH_PROVIDER_NAME}")
-        logger.debug(f"Payload: {payload}")
-        response = requests.post(f"{cls.OAUTH_BASE_URL}{cls.OAUTH_TOKEN_ENDPOINT}", data=payload)
+        logger.info("Requesting tokens from %s", cls.OAUTH_PROVIDER_NAME)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Payload: %s", _redact(payload))
+        response = _get_session().post(f"{cls.OAUTH_BASE_URL}{cls.OAUTH_TOKEN_ENDPOINT}", data=payload, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
 
-        logger.info(f"Received response from {cls.OAUTH_PROVIDER_NAME}")
-        logger.debug(f"Response: {response.json()}")
-
-        data = response.json()
+        logger.info("Received response from %s", cls.OAUTH_PROVIDER_NAME)
+        data = _loads(response.content)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Response: %s", _redact(data))
 
         if "access_token" not in data or "expires_in" not in data:
-            raise RuntimeError(f"Unexpected response format: {data}")
+            raise RuntimeError(f"Unexpected response format: {_redact(data)}")
+
+        return data
+
+    @classmethod
+    def save_token_response(cls, data, user_id="default"):
+        """
+        Persist a provider token response for a user.
+
+        Args:
+            data (dict): The provider's token response.
+            user_id (str): Identifier for the user.
 
+        Returns:
+            Saved OAuthToken instance.
+        """
         token_type = data.get("token_type", "Bearer")
 
-        logger.debug(f"Saving {cls.OAUTH_PROVIDER_NAME} token for user {user_id}")
+        logger.debug("Saving %s token for user %s", cls.OAUTH_PROVIDER_NAME, user_id)
         return cls.save_or_update_token(
             user_id=user_id,
             service=cls.OAUTH_PROVIDER_NAME,
@@ -171,10 +298,48 @@ class OAuthService:
         Refresh the OAuth access token using the stored refresh token.
 
         Args:
-            token (AUTH_TOKEN_MODEL): The token model instance.
+            token (OAuthToken): The token model instance.
+
+        Returns:
+            Updated OAuthToken instance.
+        """
+        data = cls.fetch_refreshed_token(token)
+
+        # Persist through save_or_update_token so provider overrides of it are honoured
+        return cls.save_token_response(data, token.user_id)
+
+    @classmethod
+    def apply_token_response(cls, token, data):
+        """
+        Copy a provider's refresh response onto a token instance, without saving it, for
+        bulk persistence. Mirrors save_token_response: the stored refresh token is only
+        replaced when the provider rotates it.
+
+        Args:
+            token (OAuthToken): The token model instance.
+            data (dict): The provider's token response.
 
         Returns:
-            Updated AUTH_TOKEN_MODEL instance.
+            The updated OAuthToken instance.
+        """
+        token.access_token = data["access_token"]
+        if data.get("refresh_token"):
+            token.refresh_token = data["refresh_token"]
+        token.expires_at = cls.get_expires_at(data["expires_in"])
+        token.token_type = data.get("token_type", "Bearer")
+        token.updated_at = now()
+        return token
+
+    @classmethod
+    def fetch_refreshed_token(cls, token):
+        """
+        Request a new access token from the provider without persisting it.
+
+        Args:
+            token (OAuthToken): The token model instance.
+
+        Returns:
+            dict: The provider's token response.
         """
         if not cls.OAUTH_CLIENT_ID or not cls.OAUTH_CLIENT_SECRET:
             raise RuntimeError("OAuth credentials missing in subclass.")
@@ -189,21 +354,15 @@ class OAuthService:
             "grant_type": "refresh_token",
         }
 
-        response = requests.post(f"{cls.OAUTH_BASE_URL}{cls.OAUTH_TOKEN_ENDPOINT}", data=payload)
+        response = _get_session().post(f"{cls.OAUTH_BASE_URL}{cls.OAUTH_TOKEN_ENDPOINT}", data=payload, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
 
-        data = response.json()
+        data = _loads(response.content)
 
         if "access_token" not in data or "expires_in" not in data:
-            raise RuntimeError(f"Unexpected response format: {data}")
+            raise RuntimeError(f"Unexpected response format: {_redact(data)}")
 
-        return cls.save_or_update_token(
-            user_id=token.user_id,
-            service=cls.OAUTH_PROVIDER_NAME,
-            access_token=data["access_token"],
-            refresh_token=None,
-            expires_in=data["expires_in"],
-        )
+        return data
 
     @classmethod
     def revoke_token(cls, access_token):
@@ -219,11 +378,11 @@ class OAuthService:
         url = f"{cls.OAUTH_BASE_URL}{cls.OAUTH_REVOKE_ENDPOINT}"
         payload = {"token": access_token}
 
-        response = requests.post(url, data=payload)
+        response = _get_session().post(url, data=payload, timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
             logger.info("OAuth token revoked successfully.")
         else:
-            logger.error(f"Failed to revoke token: {response.json()}")
+            logger.error("Failed to revoke token: %s", _loads(response.content))
 
     @classmethod
     def save_or_update_token(cls, user_id, service, access_token, refresh_token, expires_in, token_type="Bearer"):
@@ -239,37 +398,58 @@ class OAuthService:
             token_type (str): The type of token (default: "Bearer").
 
         Returns:
-            Updated AUTH_TOKEN_MODEL instance.
+            Saved OAuthToken instance.
         """
 
-        logger.debug(f"Saving {service} token for user {user_id}")
+        logger.debug("Saving %s token for user %s", service, user_id)
 
-        OAuthToken = cls().AUTH_TOKEN_MODEL
-        if not OAuthToken:
-            raise RuntimeError("AUTH_TOKEN_MODEL is not defined in subclass.")
+        OAuthToken = cls._get_token_model()
 
-        logger.debug(f"Token expires in {expires_in} seconds")
-        # Ensure we fetch ONLY the token for the correct service
-        existing_token = OAuthToken.objects.filter(user_id=user_id, service=service).first()
+        logger.debug("Token expires in %s seconds", expires_in)
+        token = OAuthToken(
+            user_id=user_id,
+            service=service,
+            access_token=access_token,
+            refresh_token=refresh_token,
+            expires_at=cls.get_expires_at(expires_in),
+            token_type=token_type,
+        )
 
-        logger.debug(f"Existing token: {existing_token}")
-        # Preserve refresh_token if it's missing in the new response
-        if not refresh_token and existing_token:
-            refresh_token = existing_token.refresh_token
+        # Single INSERT ... ON CONFLICT DO UPDATE. Leaving refresh_token out of the
+        # update preserves the stored one when the provider didn't send a new one.
+        update_fields = ["access_token", "expires_at", "token_type", "updated_at"]
+        if refresh_token:
+            update_fields.append("refresh_token")
 
-        token, created = OAuthToken.objects.update_or_create(
-            user_id=user_id,
-            service=service,  # Ensure service is used for filtering
-            defaults={
-                "access_token": access_token,
-                "refresh_token": refresh_token,  # Preserves correct refresh token
-                "expires_at": now() + datetime.timedelta(seconds=expires_in - 60),
-                "token_type": token_type,
-            },
+        db = router.db_for_write(OAuthToken)
+        unique_fields = ["user_id", "service"] if connections[db].features.supports_update_conflicts_with_target else None
+
+        OAuthToken.objects.using(db).bulk_create(
+            [token],
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=update_fields,
         )
-        logger.debug(f"Token created: {created}")
+        logger.debug("Token saved for %s user %s", service, user_id)
+        # The upsert only returns the pk on Django 5.0+ (PostgreSQL/SQLite) and never the
+        # preserved refresh_token; reload the stored row in those cases.
+        if token.pk is None or not refresh_token:
+            token = OAuthToken.objects.using(db).get(user_id=user_id, service=service)
         return token
 
+    @classmethod
+    def get_expires_at(cls, expires_in):
+        """
+        Compute the expiry timestamp for a token, keeping a 60 second safety margin.
+
+        Args:
+            expires_in (int): Token expiry time in seconds.
+
+        Returns:
+            datetime: The expiry timestamp.
+        """
+        return now() + datetime.timedelta(seconds=expires_in - 60)
+
     @classmethod
     def get_redirect_uri(cls, request=None):
         """
@@ -285,9 +465,9 @@ class OAuthService:
             raise RuntimeError("OAUTH_PROVIDER_NAME must be defined in the subclass.")
 
         # Get the relative path for the OAuth callback
-        relative_path = reverse(f"{cls.APP_NAME}:{cls.OAUTH_PROVIDER_NAME}_callback")
+        relative_path = _reverse_callback(cls.APP_NAME, cls.OAUTH_PROVIDER_NAME, get_script_prefix())
 
-        logger.info(f"Building redirect URI for {cls.OAUTH_PROVIDER_NAME} callbackw with relative path: {relative_path}")
+        logger.info("Building redirect URI for %s callbackw with relative path: %s", cls.OAUTH_PROVIDER_NAME, relative_path)
 
         # 1️⃣ If request is provided, use it to build the absolute URI
         if request:
@@ -295,7 +475,7 @@ class OAuthService:
             return request.build_absolute_uri(relative_path)
 
         # 2️⃣ If request is NOT available, use the SITE_URL from settings
-        base_url = get_setting("SITE_URL")
+        base_url = _get_site_url()
         if not base_url:
             raise RuntimeError("SITE_URL setting is not defined.")
         return f"{base_url}{relative_path}"
@@ -1 +1 @@
-from .base_oauth_views import BaseOAuthViewSet
\ No newline at end of file
+from .base_oauth_views import BaseOAuthViewSet, BaseOAuthCallbackView
\ No newline at end of file
@@ -2,15 +2,16 @@ import logging
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.http import JsonResponse
+from django.views import View
 from rest_framework.viewsets import ViewSet
 from rest_framework.decorators import action
 
 logger = logging.getLogger("oauth")
 
-class BaseOAuthViewSet(ViewSet):
+
+class OAuthServiceMixin:
     """
-    Generic OAuth viewset to handle authentication flows for multiple providers.
-    Each provider should subclass this and define the appropriate OAuthService.
+    Resolves the OAuthService configured on a provider's view.
     """
 
     OAUTH_SERVICE = None  # Must be set in the subclass
@@ -20,6 +21,49 @@ class BaseOAuthViewSet(ViewSet):
             raise RuntimeError("OAUTH_SERVICE must be defined in the subclass.")
         return self.OAUTH_SERVICE
 
+
+# Shared by the sync and async callback views, which differ only in how the code is exchanged
+
+def _get_callback_code(request, oauth_service):
+    """
+    Return the authorization code from the callback request, or None if it is missing.
+    """
+    code = request.GET.get("code")
+
+    logger.info("Received OAuth callback for %s", oauth_service.OAUTH_PROVIDER_NAME)
+    if not code:
+        logger.error("Authorization code not found in callback")
+        return None
+
+    logger.info("Exchanging authorization code for tokens with %s", oauth_service.OAUTH_PROVIDER_NAME)
+    return code
+
+
+def _missing_code_response():
+    return JsonResponse({"error": "Authorization code not found"}, status=400)
+
+
+def _callback_success_response(oauth_service):
+    logger.info("OAuth token successfully retrieved and stored for %s", oauth_service.OAUTH_PROVIDER_NAME)
+
+    # 🎯 Redirect to Django Admin to view tokens
+    return redirect(reverse("admin:prtls_oauth_oauthtoken_changelist"))
+
+
+def _callback_error_response(e):
+    if isinstance(e, RuntimeError):
+        logger.error("Error during OAuth callback handling: %s", e)
+        return JsonResponse({"error": str(e)}, status=500)
+    logger.error("Unexpected error during OAuth callback handling: %s", e)
+    return JsonResponse({"error": "An unexpected error occurred"}, status=500)
+
+
+class BaseOAuthViewSet(OAuthServiceMixin, ViewSet):
+    """
+    Generic OAuth viewset to handle authentication flows for multiple providers.
+    Each provider should subclass this and define the appropriate OAuthService.
+    """
+
     @action(detail=False, methods=["get"], url_path="authorize")
     def authorize(self, request):
         """
@@ -28,13 +72,13 @@ class BaseOAuthViewSet(ViewSet):
         try:
             oauth_service = self.get_oauth_service()
             auth_url = oauth_service.get_authorization_url()
-            logger.info(f"Redirecting to {oauth_service.OAUTH_PROVIDER_NAME} authorization URL")
+            logger.info("Redirecting to %s authorization URL", oauth_service.OAUTH_PROVIDER_NAME)
             return redirect(auth_url)
         except RuntimeError as e:
-            logger.error(f"Failed to generate authorization URL: {e}")
+            logger.error("Failed to generate authorization URL: %s", e)
             return JsonResponse({"error": str(e)}, status=500)
         except Exception as e:
-            logger.error(f"Unexpected error during authorization: {e}")
+            logger.error("Unexpected error during authorization: %s", e)
             return JsonResponse({"error": "An unexpected error occurred while redirecting"}, status=500)
 
     @action(detail=False, methods=["get"], url_path="callback")
@@ -45,25 +89,38 @@ class BaseOAuthViewSet(ViewSet):
         try:
             logger.info("Handling OAuth callback")
             oauth_service = self.get_oauth_service()
-            code = request.GET.get("code")
-
-            logger.info(f"Received authorization code: {code}")
+            code = _get_callback_code(request, oauth_service)
             if not code:
-                logger.error("Authorization code not found in callback")
-                return JsonResponse({"error": "Authorization code not found"}, status=400)
+                return _missing_code_response()
 
             # 🔹 Exchange code for tokens (Service handles saving)
-
-            logger.info(f"Exchanging authorization code for tokens with {oauth_service.OAUTH_PROVIDER_NAME}")
             oauth_service.exchange_authorization_code(code)
-            logger.info(f"OAuth token successfully retrieved and stored for {oauth_service.OAUTH_PROVIDER_NAME}")
+            return _callback_success_response(oauth_service)
 
-            # 🎯 Redirect to Django Admin to view tokens
-            return redirect(reverse("admin:prtls_oauth_oauthtoken_changelist"))
+        except Exception as e:
+            return _callback_error_response(e)
+
+
+class BaseOAuthCallbackView(OAuthServiceMixin, View):
+    """
+    Async OAuth callback view. Under ASGI, the worker is not blocked while the
+    authorization code is exchanged with the provider.
+    Each provider should subclass this and define the appropriate OAuthService.
+    """
+
+    async def get(self, request):
+        """
+        Handles the OAuth callback and exchanges the authorization code for tokens.
+        """
+        try:
+            logger.info("Handling OAuth callback")
+            oauth_service = self.get_oauth_service()
+            code = _get_callback_code(request, oauth_service)
+            if not code:
+                return _missing_code_response()
+
+            await oauth_service.aexchange_authorization_code(code)
+            return _callback_success_response(oauth_service)
 
-        except RuntimeError as e:
-            logger.error(f"Error during OAuth callback handling: {e}")
-            return JsonResponse({"error": str(e)}, status=500)
         except Exception as e:
-            logger.error(f"Unexpected error during OAuth callback handling: {e}")
-            return JsonResponse({"error": "An unexpected error occurred"}, status=500)
+            return _callback_error_response(e)
@@ -21,6 +21,9 @@ setup(
         "urllib3>=1.26.16"
     ],
     extras_require={
+        "orjson": [
+            "orjson>=3.8",
+        ],
         "dev": [
             "black",
             "pytest",